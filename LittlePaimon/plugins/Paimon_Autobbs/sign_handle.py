@@ -10,7 +10,7 @@ from nonebot import get_bot
 from LittlePaimon.config import config
 from LittlePaimon.database import MihoyoBBSSub, LastQuery, PrivateCookie
 from LittlePaimon.utils import logger, scheduler, DRIVER
-from LittlePaimon.utils.api import get_mihoyo_private_data, get_sign_reward_list, mihoyo_sign_headers, check_retcode
+from LittlePaimon.utils.api import get_mihoyo_private_data, get_sign_reward_list, mihoyo_sign_headers, check_retcode, get_server_id
 from LittlePaimon.utils.requests import aiorequests
 from .draw import SignResult, draw_result
 
@@ -26,7 +26,7 @@ sign_reward_list: dict = {}
 
 
 async def sign_action(user_id: str, uid: str) -> Union[dict, str]:
-    server_id = 'cn_qd01' if uid[0] == '5' else 'cn_gf01'
+    server_id = get_server_id(uid)
     cookie_info = await PrivateCookie.get_or_none(user_id=user_id, uid=uid)
     resp = await aiorequests.post(SIGN_ACTION_API, headers=mihoyo_sign_headers(cookie_info.cookie),
                                   json={
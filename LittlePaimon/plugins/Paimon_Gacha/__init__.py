@@ -79,22 +79,20 @@ def get_num(num):
 async def _(event: MessageEvent, reGroup: Dict = RegexDict()):
     nickname = event.sender.nickname
     if isinstance(event, GroupMessageEvent):
-        if not lmt.check(f'gacha-group{event.user_id}'):
-            await sim_gacha.finish(f'今日抽卡机会无啦，明天再来吧~')
-        elif not freq_limiter.check(f'gacha-group{event.group_id}'):
+        if not freq_limiter.check(f'gacha-group{event.group_id}'):
             await sim_gacha.finish(f'当前群模拟抽卡冷却ing...剩余{freq_limiter.left(f"gacha-group{event.group_id}")}秒')
         elif not freq_limiter.check(f'gacha-group{event.user_id}'):
             await sim_gacha.finish(f'你的模拟抽卡冷却ing...剩余{freq_limiter.left(f"gacha-group{event.user_id}")}秒', at_sender=True)
     elif isinstance(event, PrivateMessageEvent):
-        if not lmt.check(f'gacha-group{event.user_id}'):
-            await sim_gacha.finish(f'今日抽卡机会无啦，明天再来吧~')
-        elif not freq_limiter.check(f'gacha-group{event.user_id}'):
+        if not freq_limiter.check(f'gacha-group{event.user_id}'):
             await sim_gacha.finish(f'你的模拟抽卡冷却ing...剩余{freq_limiter.left(f"gacha-group{event.user_id}")}秒', at_sender=True)
     num = reGroup['num']
     pool = reGroup['pool']
     num = get_num(num)
     if num > config.sim_gacha_max:
         await sim_gacha.finish(f'单次最多只能{config.sim_gacha_max}十连哦！')
+    if not lmt.try_consume(f'gacha-group{event.user_id}'):
+        await sim_gacha.finish(f'今日抽卡机会无啦，明天再来吧~')
     pool = pool or '角色1'
     try:
         result = await draw_gacha_img(event.user_id, pool, num, nickname)
@@ -105,10 +103,8 @@ async def _(event: MessageEvent, reGroup: Dict = RegexDict()):
     if isinstance(event, GroupMessageEvent):
         freq_limiter.start(f'gacha-group{event.group_id}', config.sim_gacha_cd_group)
         freq_limiter.start(f'gacha-group{event.user_id}', config.sim_gacha_cd_member)
-        lmt.increase(f'gacha-group{event.user_id}')
     elif isinstance(event, PrivateMessageEvent):
         freq_limiter.start(f'gacha-group{event.user_id}', config.sim_gacha_cd_member)
-        lmt.increase(f'gacha-group{event.user_id}')
     await sim_gacha.finish(result)
 
 
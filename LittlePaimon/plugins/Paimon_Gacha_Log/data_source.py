@@ -11,7 +11,7 @@ from nonebot.rule import Rule
 from LittlePaimon.database import PlayerInfo, LastQuery
 from LittlePaimon.utils import logger, __version__
 from LittlePaimon.utils.requests import aiorequests
-from LittlePaimon.utils.api import get_authkey_by_stoken
+from LittlePaimon.utils.api import get_authkey_by_stoken, get_server_id
 from LittlePaimon.utils.files import load_json, save_json
 from LittlePaimon.utils.path import GACHA_LOG
 from .draw import draw_gacha_log
@@ -135,7 +135,7 @@ async def get_gacha_log_data(user_id: str, uid: str):
         '常驻祈愿': 0,
         '新手祈愿': 0,
     }
-    server_id = 'cn_qd01' if uid[0] == '5' else 'cn_gf01'
+    server_id = get_server_id(uid)
     authkey, state, cookie_info = await get_authkey_by_stoken(user_id, uid)
     if not state:
         return authkey
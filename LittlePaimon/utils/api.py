@@ -1,3 +1,4 @@
+import asyncio
 import contextlib
 import hashlib
 import json
@@ -6,12 +7,18 @@ import string
 import time
 from typing import Optional, Literal, Union, Tuple
 
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
+
+import httpx
 from nonebot import logger as nb_logger
 from tortoise.queryset import Q
 
 from LittlePaimon.config import config
 from LittlePaimon.database import PublicCookie, PrivateCookie, CookieCache
-from LittlePaimon.utils import logger
+from LittlePaimon.utils import logger, DRIVER
 from .requests import aiorequests
 
 # MIHOYO_API = 'https://api-takumi-record.mihoyo.com/'
@@ -31,6 +38,29 @@ STOKEN_API = 'https://api-takumi.mihoyo.com/auth/api/getMultiTokenByLoginTicket'
 COOKIE_TOKEN_API = 'https://api-takumi.mihoyo.com/auth/api/getCookieAccountInfoBySToken'
 LOGIN_TICKET_INFO_API = 'https://webapi.account.mihoyo.com/Api/cookie_accountinfo_by_loginticket'
 
+# 米游社api共用的连接池，避免每次请求都重新握手
+_CLIENT = httpx.AsyncClient(timeout=20,
+                            limits=httpx.Limits(max_keepalive_connections=32, max_connections=64))
+
+SERVER_QD = 'cn_qd01'
+SERVER_GF = 'cn_gf01'
+# uid首位对应的服务器，不在其中的为官服
+_SERVERS = {'5': SERVER_QD}
+
+
+def get_server_id(uid: Union[str, int]) -> str:
+    """
+    根据uid获取服务器id
+        :param uid: 原神uid
+        :return: 服务器id
+    """
+    return _SERVERS.get(str(uid)[:1], SERVER_GF)
+
+
+@DRIVER.on_shutdown
+async def close_client():
+    await _CLIENT.aclose()
+
 
 def md5(text: str) -> str:
     """
@@ -97,6 +127,16 @@ def get_old_version_ds(mhy_bbs: bool = False) -> str:
     return f"{t},{r},{c}"
 
 
+_MIHOYO_HEADERS = {
+    'Origin':            'https://webstatic.mihoyo.com',
+    'x-rpc-app_version': "2.11.1",
+    'User-Agent':        'Mozilla/5.0 (iPhone; CPU iPhone OS 13_2_3 like Mac OS '
+                         'X) AppleWebKit/605.1.15 (KHTML, like Gecko) miHoYoBBS/2.11.1',
+    'x-rpc-client_type': '5',
+    'Referer':           'https://webstatic.mihoyo.com/'
+}
+
+
 def mihoyo_headers(cookie, q='', b=None) -> dict:
     """
     生成米游社headers
@@ -105,16 +145,7 @@ def mihoyo_headers(cookie, q='', b=None) -> dict:
         :param b: 请求体
         :return: headers
     """
-    return {
-        'DS':                get_ds(q, b),
-        'Origin':            'https://webstatic.mihoyo.com',
-        'Cookie':            cookie,
-        'x-rpc-app_version': "2.11.1",
-        'User-Agent':        'Mozilla/5.0 (iPhone; CPU iPhone OS 13_2_3 like Mac OS '
-                             'X) AppleWebKit/605.1.15 (KHTML, like Gecko) miHoYoBBS/2.11.1',
-        'x-rpc-client_type': '5',
-        'Referer':           'https://webstatic.mihoyo.com/'
-    }
+    return {**_MIHOYO_HEADERS, 'DS': get_ds(q, b), 'Cookie': cookie}
 
 
 def mihoyo_sign_headers(cookie: str, extra_headers: Optional[dict] = None) -> dict:
@@ -142,6 +173,15 @@ def mihoyo_sign_headers(cookie: str, extra_headers: Optional[dict] = None) -> di
     return header
 
 
+# 后台写库任务的强引用，防止任务在完成前被回收
+_bg_tasks = set()
+
+
+def _log_cache_write_error(task: asyncio.Task):
+    if not task.cancelled() and (e := task.exception()) is not None:
+        logger.warning('原神Cookie', f'写入cookie缓存<r>失败</r>：{e!r}')
+
+
 async def check_retcode(data: dict, cookie_info, user_id: str, uid: str) -> bool:
     """
     检查数据响应状态冰进行响应处理
@@ -188,7 +228,11 @@ async def check_retcode(data: dict, cookie_info, user_id: str, uid: str) -> bool
         return False
     else:
         if isinstance(cookie_info, PublicCookie) and data['retcode'] != 1034:
-            await CookieCache.update_or_create(uid=uid, defaults={'cookie': cookie_info.cookie})
+            # 缓存记录结果不影响本次返回，无需等待写库完成
+            task = asyncio.ensure_future(CookieCache.update_or_create(uid=uid, defaults={'cookie': cookie_info.cookie}))
+            _bg_tasks.add(task)
+            task.add_done_callback(_bg_tasks.discard)
+            task.add_done_callback(_log_cache_write_error)
         return True
 
 
@@ -237,48 +281,51 @@ async def get_bind_game_info(cookie: str, mys_id: str):
     return None
 
 
+async def _request_mihoyo_api(url: str, cookie: str, params: dict, method: Literal['GET', 'POST'] = 'GET') -> dict:
+    """
+    携带米游社headers请求米游社api
+        :param url: api地址
+        :param cookie: cookie
+        :param params: GET时为查询参数，POST时为请求体
+        :param method: 请求方法
+        :return: 响应数据
+    """
+    if method == 'GET':
+        resp = await _CLIENT.get(url=url,
+                                 headers=mihoyo_headers(q='&'.join(f'{k}={v}' for k, v in params.items()),
+                                                        cookie=cookie),
+                                 params=params)
+    else:
+        resp = await _CLIENT.post(url=url,
+                                  headers=mihoyo_headers(b=params, cookie=cookie),
+                                  json=params)
+    return json_loads(resp.content)
+
+
 async def get_mihoyo_public_data(
         uid: str,
         user_id: Optional[str],
         mode: Literal['abyss', 'player_card', 'role_detail'],
         schedule_type: Optional[str] = '1'):
-    server_id = 'cn_qd01' if uid[0] == '5' else 'cn_gf01'
+    server_id = get_server_id(uid)
+    if mode == 'abyss':
+        url, method, params = ABYSS_API, 'GET', {'role_id': uid, 'schedule_type': schedule_type, 'server': server_id}
+    elif mode == 'player_card':
+        url, method, params = PLAYER_CARD_API, 'GET', {'role_id': uid, 'server': server_id}
+    elif mode == 'role_detail':
+        url, method, params = CHARACTER_DETAIL_API, 'POST', {'server': server_id, 'role_id': uid, 'character_ids': []}
+    else:
+        url = method = params = None
     check = True
+    tried = set()
     while True:
         cookie_info = await get_cookie(user_id, uid, check)
         check = False
-        if not cookie_info:
+        # check_retcode失败时会使该cookie失效，若同一cookie再次出现则不再重试，避免死循环
+        if not cookie_info or cookie_info.cookie in tried:
             return '当前没有可使用的cookie，请绑定私人cookie或联系超级管理员添加公共cookie，'
-        if mode == 'abyss':
-            data = await aiorequests.get(url=ABYSS_API,
-                                         headers=mihoyo_headers(
-                                             q=f'role_id={uid}&schedule_type={schedule_type}&server={server_id}',
-                                             cookie=cookie_info.cookie),
-                                         params={
-                                             "schedule_type": schedule_type,
-                                             "role_id":       uid,
-                                             "server":        server_id}
-                                         )
-        elif mode == 'player_card':
-            data = await aiorequests.get(url=PLAYER_CARD_API,
-                                         headers=mihoyo_headers(q=f'role_id={uid}&server={server_id}',
-                                                                cookie=cookie_info.cookie),
-                                         params={
-                                             'server':  server_id,
-                                             'role_id': uid
-                                         })
-        elif mode == 'role_detail':
-            json_data = {
-                "server":        server_id,
-                "role_id":       uid,
-                "character_ids": []
-            }
-            data = await aiorequests.post(url=CHARACTER_DETAIL_API,
-                                          headers=mihoyo_headers(b=json_data, cookie=cookie_info.cookie),
-                                          json=json_data)
-        else:
-            data = None
-        data = data.json() if data else {'retcode': 999}
+        tried.add(cookie_info.cookie)
+        data = await _request_mihoyo_api(url, cookie_info.cookie, params, method) if url else {'retcode': 999}
         nb_logger.debug(data)
         if await check_retcode(data, cookie_info, user_id, uid):
             return data
@@ -290,38 +337,22 @@ async def get_mihoyo_private_data(
         mode: Literal['role_skill', 'month_info', 'daily_note', 'sign_info', 'sign_action'],
         role_id: Optional[str] = None,
         month: Optional[str] = None):
-    server_id = 'cn_qd01' if uid[0] == '5' else 'cn_gf01'
+    server_id = get_server_id(uid)
     cookie_info = await get_cookie(user_id, uid, True, True)
     if not cookie_info:
         return '未绑定私人cookie，绑定方法二选一：\n1.通过米游社扫码绑定：\n请发送指令[原神扫码绑定]\n2.获取cookie的教程：\ndocs.qq.com/doc/DQ3JLWk1vQVllZ2Z1\n获取后，使用[ysb cookie]指令绑定' \
                + (f'或前往{config.CookieWeb_url}网页添加绑定' if config.CookieWeb_enable else '')
     if mode == 'role_skill':
-        data = await aiorequests.get(url=CHARACTER_SKILL_API,
-                                     headers=mihoyo_headers(q=f'uid={uid}&region={server_id}&avatar_id={role_id}',
-                                                            cookie=cookie_info.cookie),
-                                     params={
-                                         "region":    server_id,
-                                         "uid":       uid,
-                                         "avatar_id": role_id})
+        data = await _request_mihoyo_api(CHARACTER_SKILL_API, cookie_info.cookie,
+                                         {'uid': uid, 'region': server_id, 'avatar_id': role_id})
     elif mode == 'month_info':
-        data = await aiorequests.get(url=MONTH_INFO_API,
-                                     headers=mihoyo_headers(q=f'month={month}&bind_uid={uid}&bind_region={server_id}',
-                                                            cookie=cookie_info.cookie),
-                                     params={
-                                         "month":       month,
-                                         "bind_uid":    uid,
-                                         "bind_region": server_id
-                                     })
+        data = await _request_mihoyo_api(MONTH_INFO_API, cookie_info.cookie,
+                                         {'month': month, 'bind_uid': uid, 'bind_region': server_id})
     elif mode == 'daily_note':
-        data = await aiorequests.get(url=DAILY_NOTE_API,
-                                     headers=mihoyo_headers(q=f'role_id={uid}&server={server_id}',
-                                                            cookie=cookie_info.cookie),
-                                     params={
-                                         "server":  server_id,
-                                         "role_id": uid
-                                     })
+        data = await _request_mihoyo_api(DAILY_NOTE_API, cookie_info.cookie,
+                                         {'role_id': uid, 'server': server_id})
     elif mode == 'sign_info':
-        data = await aiorequests.get(url=SIGN_INFO_API,
+        resp = await aiorequests.get(url=SIGN_INFO_API,
                                      headers={
                                          'x-rpc-app_version': '2.11.1',
                                          'x-rpc-client_type': '5',
@@ -336,17 +367,18 @@ async def get_mihoyo_private_data(
                                          'region': server_id,
                                          'uid':    uid
                                      })
+        data = json_loads(resp.content)
     elif mode == 'sign_action':
-        data = await aiorequests.post(url=SIGN_ACTION_API,
+        resp = await aiorequests.post(url=SIGN_ACTION_API,
                                       headers=mihoyo_sign_headers(cookie_info.cookie),
                                       json={
                                           'act_id': 'e202009291139501',
                                           'uid':    uid,
                                           'region': server_id
                                       })
+        data = json_loads(resp.content)
     else:
-        data = None
-    data = data.json() if data else {'retcode': 999}
+        data = {'retcode': 999}
     nb_logger.debug(data)
     if await check_retcode(data, cookie_info, user_id, uid):
         return data
@@ -367,7 +399,7 @@ async def get_sign_reward_list() -> dict:
                                  params={
                                      'act_id': 'e202009291139501'
                                  })
-    data = resp.json()
+    data = json_loads(resp.content)
     nb_logger.debug(data)
     return data
 
@@ -419,7 +451,7 @@ async def get_authkey_by_stoken(user_id: str, uid: str) -> Tuple[Optional[str],
     :param uid: 原神uid
     :return: authkey
     """
-    server_id = 'cn_qd01' if uid[0] == '5' else 'cn_gf01'
+    server_id = get_server_id(uid)
     cookie_info = await get_cookie(user_id, uid, True, True)
     if not cookie_info:
         return '未绑定私人cookie，绑定方法二选一：\n1.通过米游社扫码绑定：\n请发送指令[原神扫码绑定]\n2.获取cookie的教程：\ndocs.qq.com/doc/DQ3JLWk1vQVllZ2Z1\n获取后，使用[ysb cookie]指令绑定' \
@@ -147,20 +147,19 @@ class aiorequests:
             :param exclude_json: 是否排除json文件
         """
         save_path.parent.mkdir(parents=True, exist_ok=True)
-        async with httpx.AsyncClient().stream(method='GET', url=url, follow_redirects=True) as datas:
+        async with httpx.AsyncClient() as client, client.stream(method='GET', url=url, follow_redirects=True) as datas:
             if exclude_json and 'application/json' in str(datas.headers['Content-Type']):
                 raise Exception('file not match type')
             size = int(datas.headers['Content-Length'])
-            f = save_path.open('wb')
-            async for chunk in tqdm.asyncio.tqdm(iterable=datas.aiter_bytes(1),
-                                                 desc=url.split('/')[-1],
-                                                 unit='iB',
-                                                 unit_scale=True,
-                                                 unit_divisor=1024,
-                                                 total=size,
-                                                 colour='green'):
-                f.write(chunk)
-            f.close()
+            with save_path.open('wb') as f, tqdm.asyncio.tqdm(desc=url.split('/')[-1],
+                                                              unit='iB',
+                                                              unit_scale=True,
+                                                              unit_divisor=1024,
+                                                              total=size,
+                                                              colour='green') as bar:
+                async for chunk in datas.aiter_bytes(1 << 16):
+                    f.write(chunk)
+                    bar.update(len(chunk))
 
     @staticmethod
     async def download_icon(name: str,
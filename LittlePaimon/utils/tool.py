@@ -4,9 +4,16 @@ import functools
 import hashlib
 import inspect
 import time
-import pytz
-from collections import defaultdict
+from collections import OrderedDict, defaultdict
 from pathlib import Path
+from typing import Optional
+
+from nonebot.utils import run_sync
+
+try:
+    from blake3 import blake3
+except ImportError:
+    blake3 = None
 
 from LittlePaimon.config import config
 from .logger import logger
@@ -14,24 +21,51 @@ from .requests import aiorequests
 
 RESOURCE_BASE_PATH = Path() / 'resources'
 
+
+def _next_shanghai_midnight(now: Optional[float] = None) -> float:
+    """
+    计算下一个北京时间零点的时间戳
+        :param now: 当前时间戳，为空则取当前时间
+        :return: 时间戳
+    """
+    if now is None:
+        now = time.time()
+    return (now + 8 * 3600) // 86400 * 86400 + 86400 - 8 * 3600
+
+
 class DailyNumberLimiter:
     """
     每日计次
     """
-    tz = pytz.timezone('Asia/Shanghai')
 
     def __init__(self, max_num):
-        self.today = -1
+        self._next_rollover_ts = _next_shanghai_midnight()
         self.count = defaultdict(int)
         self.max = max_num
 
     def check(self, key) -> bool:
-        now = datetime.datetime.now(self.tz)
-        day = (now - datetime.timedelta(hours=0)).day #每日零点刷新计次
-        if day != self.today:
-            self.today = day
+        self._rollover()
+        return self.count[key] < self.max
+
+    def try_consume(self, key) -> bool:
+        """
+        检查并计次，次数未用完时计一次并返回True
+            :param key: key
+            :return: 是否计次成功
+        """
+        self._rollover()
+        c = self.count
+        v = c[key]
+        if v >= self.max:
+            return False
+        c[key] = v + 1
+        return True
+
+    def _rollover(self):
+        now = time.time()
+        if now >= self._next_rollover_ts:  # 每日零点刷新计次
             self.count.clear()
-        return bool(self.count[key] < self.max)
+            self._next_rollover_ts = _next_shanghai_midnight(now)
 
     def get_num(self, key):
         return self.count[key]
@@ -47,12 +81,17 @@ class FreqLimiter:
     """
     频率限制器（冷却时间限制器）
     """
+    __slots__ = ('next_time', '_next_purge')
+
+    # 清理已结束冷却的间隔(秒)
+    PURGE_INTERVAL = 600
 
     def __init__(self):
         """
         初始化一个频率限制器
         """
-        self.next_time = defaultdict(float)
+        self.next_time = {}
+        self._next_purge = time.time() + self.PURGE_INTERVAL
 
     def check(self, key: str) -> bool:
         """
@@ -60,7 +99,7 @@ class FreqLimiter:
             :param key: key
             :return: 布尔值
         """
-        return time.time() >= self.next_time[key]
+        return time.time() >= self.next_time.get(key, 0.0)
 
     def start(self, key: str, cooldown_time: int = 0):
         """
@@ -68,7 +107,13 @@ class FreqLimiter:
             :param key: key
             :param cooldown_time: 冷却时间(秒)
         """
-        self.next_time[key] = time.time() + (cooldown_time if cooldown_time > 0 else 60)
+        now = time.time()
+        if now >= self._next_purge:
+            # 定期清理已结束的冷却，避免key无限增长
+            for k in [k for k, v in self.next_time.items() if v <= now]:
+                del self.next_time[k]
+            self._next_purge = now + self.PURGE_INTERVAL
+        self.next_time[key] = now + (cooldown_time if cooldown_time > 0 else 60)
 
     def left(self, key: str) -> int:
         """
@@ -76,44 +121,63 @@ class FreqLimiter:
             :param key: key
             :return: 剩余冷却时间
         """
-        return int(self.next_time[key] - time.time()) + 1
+        return int(self.next_time.get(key, 0.0) - time.time()) + 1
 
 
 freq_limiter = FreqLimiter()
 
 
-def cache(ttl=datetime.timedelta(hours=1)):
+def cache(ttl=datetime.timedelta(hours=1), maxsize: int = 1024):
     """
     缓存装饰器
         :param ttl: 过期时间
+        :param maxsize: 最大缓存条数，超出时淘汰最久未使用的
     """
 
     def wrap(func):
-        cache_data = {}
+        cache_data = OrderedDict()
+        ttl_s = ttl.total_seconds()
+        sig = inspect.signature(func)
+        param_names = tuple(sig.parameters)
+        defaults = {k: p.default for k, p in sig.parameters.items() if p.default is not inspect.Parameter.empty}
 
         @functools.wraps(func)
         async def wrapped(*args, **kw):
-            nonlocal cache_data
-            bound = inspect.signature(func).bind(*args, **kw)
-            bound.apply_defaults()
-            ins_key = '|'.join([f'{k}_{v}' for k, v in bound.arguments.items()])
-            default_data = {"time": None, "value": None}
-            data = cache_data.get(ins_key, default_data)
-            now = datetime.datetime.now()
-            if not data['time'] or now - data['time'] > ttl:
-                try:
-                    data['value'] = await func(*args, **kw)
-                    data['time'] = now
-                    cache_data[ins_key] = data
-                except Exception as e:
-                    raise e
-            return data['value']
+            arguments = dict(zip(param_names, args))
+            arguments.update(kw)
+            ins_key = tuple(arguments.get(k, defaults.get(k)) for k in param_names)
+            now = time.monotonic()
+            entry = cache_data.get(ins_key)
+            if entry and entry[0] > now:
+                cache_data.move_to_end(ins_key)
+                return entry[1]
+            value = await func(*args, **kw)
+            cache_data[ins_key] = (now + ttl_s, value)
+            cache_data.move_to_end(ins_key)
+            while len(cache_data) > maxsize:
+                cache_data.popitem(last=False)
+            return value
 
         return wrapped
 
     return wrap
 
 
+@run_sync
+def _file_digest(path: Path, hasher=hashlib.md5) -> bytes:
+    """
+    分块计算文件的摘要，避免一次性读入整个文件
+        :param path: 文件路径
+        :param hasher: 摘要算法，默认为md5
+        :return: 文件摘要
+    """
+    h = hasher()
+    with open(path, 'rb', buffering=0) as f:
+        while chunk := f.read(1 << 20):
+            h.update(chunk)
+    return h.digest()
+
+
 async def check_resource():
     logger.info('资源检查', '开始检查资源')
     try:
@@ -124,23 +188,49 @@ async def check_resource():
     except Exception:
         logger.info('资源检查', '读取资源列表<r>失败</r>，请尝试更换<m>github资源地址</m>')
         return
-    flag = False
-    for resource in resource_list:
+    semaphore = asyncio.Semaphore(8)
+
+    async def check_one(resource: dict) -> Optional[bool]:
+        """
+        检查并按需下载单个资源
+            :return: 资源完好为False，已下载为True，出错为None
+        """
         file_path = RESOURCE_BASE_PATH / resource['path']
-        if file_path.exists():
-            if not resource['lock'] or hashlib.md5(file_path.read_bytes()).hexdigest() == resource['hash']:
-                continue
-            else:
-                file_path.unlink()
-        flag = True
         try:
-            await aiorequests.download(
-                url=f'{config.github_proxy}https://raw.githubusercontent.com/CMHopeSunshine/LittlePaimonRes/main/{resource["path"]}',
-                save_path=file_path, exclude_json=resource['path'].split('.')[-1] != 'json')
-            await asyncio.sleep(0.5)
+            if file_path.exists():
+                if not resource['lock']:
+                    return False
+                # 资源列表提供了blake3且已安装blake3时优先使用，否则使用md5
+                if blake3 is not None and 'blake3' in resource:
+                    hasher, hash_bytes = blake3, bytes.fromhex(resource['blake3'])
+                else:
+                    hasher, hash_bytes = hashlib.md5, bytes.fromhex(resource['hash'])
+                # 资源列表提供了文件大小时，大小不符则无需再计算摘要
+                if ('size' not in resource or file_path.stat().st_size == resource['size']) \
+                        and await _file_digest(file_path, hasher) == hash_bytes:
+                    return False
+                file_path.unlink()
         except Exception:
-            logger.warning('资源检查', f'下载<m>{resource["path"]}</m>时<r>出错</r>，请尝试更换<m>github资源地址</m>')
-    if flag:
+            logger.warning('资源检查', f'校验<m>{resource["path"]}</m>时<r>出错</r>')
+            return None
+        async with semaphore:
+            try:
+                await aiorequests.download(
+                    url=f'{config.github_proxy}https://raw.githubusercontent.com/CMHopeSunshine/LittlePaimonRes/main/{resource["path"]}',
+                    save_path=file_path,
+                    exclude_json=resource['path'].split('.')[-1] != 'json')
+            except Exception:
+                logger.warning('资源检查', f'下载<m>{resource["path"]}</m>时<r>出错</r>，请尝试更换<m>github资源地址</m>')
+                return None
+        return True
+
+    results = await asyncio.gather(*[check_one(resource) for resource in resource_list], return_exceptions=True)
+    for resource, result in zip(resource_list, results):
+        if isinstance(result, BaseException):
+            logger.warning('资源检查', f'检查<m>{resource["path"]}</m>时<r>出错</r>：{result!r}')
+    if any(r is None or isinstance(r, BaseException) for r in results):
+        logger.warning('资源检查', '<r>部分资源校验或下载失败</r>，请检查上方日志')
+    elif any(r is True for r in results):
         logger.info('资源检查', '<g>资源下载完成</g>')
     else:
         logger.info('资源检查', '<g>资源完好，无需下载</g>')